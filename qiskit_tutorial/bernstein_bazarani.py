@@ -1,10 +1,68 @@
+from functools import lru_cache
+from itertools import count
+from typing import TYPE_CHECKING
+
 from qiskit import QuantumCircuit
-from qiskit_aer import AerSimulator
-from qiskit.visualization import plot_histogram
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Operations supported natively by Aer's stabilizer simulation method (its Clifford gates plus non-unitary
+# instructions), taken from AerSimulator(method="stabilizer"). rz is left out as it is only supported for
+# Clifford angles, as are control flow and Aer's save instructions.
+STABILIZER_OPS = {
+    "barrier",
+    "cx",
+    "cy",
+    "cz",
+    "delay",
+    "ecr",
+    "h",
+    "id",
+    "measure",
+    "pauli",
+    "reset",
+    "s",
+    "sdg",
+    "swap",
+    "sx",
+    "sxdg",
+    "x",
+    "y",
+    "z",
+}
+
+# Suffixes for unique circuit names, as circuits copied from a template would otherwise all share its name and
+# their results could not be told apart (e.g. by Result.get_counts)
+_circuit_ids = count()
+
+
+def _check_secret(secret_str: str):
+    # int(secret_str, 2) would also accept e.g. "0b101", "1_01" or surrounding whitespace, whose extra characters
+    # would still be counted as qubits
+    if not secret_str or not set(secret_str) <= {"0", "1"}:
+        raise ValueError(
+            f"The secret string must be a non-empty string of 0s and 1s, got {secret_str!r}."
+        )
+
+
+def _num_qubits(n: int, use_ancilla: bool, use_paired_qubits: bool) -> int:
+    return n + 1 if use_ancilla else 2 * n if use_paired_qubits else n
+
+
+@lru_cache
+def _empty_bv_circuit(
+    n: int, use_ancilla: bool, use_paired_qubits: bool
+) -> QuantumCircuit:
+    """Build the empty circuit (registers only) for a configuration once. The result must not be modified."""
+    return QuantumCircuit(_num_qubits(n, use_ancilla, use_paired_qubits), n)
 
 
 def bernstein_vazirani_circuit(
-    secret_str: str, use_ancilla: bool = True, use_paired_qubits: bool = False
+    secret_str: str,
+    use_ancilla: bool = True,
+    use_paired_qubits: bool = False,
+    template: QuantumCircuit | None = None,
 ):
     """
     Create a Bernstein-Vazirani quantum circuit based on the given secret string and configuration.
@@ -19,6 +77,9 @@ def bernstein_vazirani_circuit(
                                       Defaults to True.
         use_paired_qubits (bool, optional): Whether to use paired qubits for each bit of the
                                             secret string. Defaults to False.
+        template (QuantumCircuit, optional): An empty circuit whose registers are reused via
+                                             copy_empty_like(). Defaults to a cached empty circuit
+                                             for the given configuration.
 
     Returns:
         QuantumCircuit: A Qiskit QuantumCircuit object representing the Bernstein-Vazirani circuit.
@@ -34,6 +95,11 @@ def bernstein_vazirani_circuit(
        - Uses n qubits (input qubits only)
        - Applies X gates to the input qubits (Note: This might need adjustment based on specific requirements)
 
+    Raises:
+        ValueError: If the secret string is empty or contains characters other than 0 and 1.
+        ValueError: If the template does not have the number of qubits and clbits required by the
+                    configuration.
+
     Note:
     - The secret string 's' is interpreted with s0 as the rightmost bit and sn-1 as the leftmost bit.
     - The circuit includes initialization, oracle implementation, measurement basis change, and measurement.
@@ -44,68 +110,203 @@ def bernstein_vazirani_circuit(
         >>> circuit_no_ancilla = bernstein_vazirani_circuit("101", use_ancilla=False, use_paired_qubits=True)
     """
 
+    _check_secret(secret_str)
     n = len(secret_str)
 
     # Determine the number of qubits based on the chosen configuration
-    num_qubits = n + 1 if use_ancilla else 2 * n if use_paired_qubits else n
+    num_qubits = _num_qubits(n, use_ancilla, use_paired_qubits)
 
-    circuit = QuantumCircuit(num_qubits, n)
+    # Start from an empty circuit with the registers of the chosen configuration, so that the registers are only
+    # built once when many circuits are created, e.g. in a sweep over secret strings
+    if template is None:
+        template = _empty_bv_circuit(n, use_ancilla, use_paired_qubits)
+    elif template.num_qubits != num_qubits or template.num_clbits != n:
+        raise ValueError(
+            f"The template must have {num_qubits} qubits and {n} clbits for this configuration."
+        )
+    circuit = template.copy_empty_like(name=f"bv_{secret_str}_{next(_circuit_ids)}")
+    # Input qubits, reused for every broadcast gate and the measurement
+    qubits = list(range(n))
 
     # Initialize qubits
     if use_ancilla:
         circuit.x(n)
-        circuit.h(range(n + 1))
+        circuit.h(qubits + [n])
     else:
-        circuit.h(range(n))
+        circuit.h(qubits)
 
     circuit.barrier()
 
     # Oracle implementation
-    for i, bit in enumerate(reversed(secret_str)):
-        if bit == "1":
-            if use_ancilla:
-                circuit.cx(i, n)
-            elif use_paired_qubits:
-                circuit.cx(i, n + i)
-            else:
-                # For the case without ancilla or paired qubits, we might need a different approach
-                # This is a placeholder and might need adjustment based on specific requirements
-                circuit.x(i)
+    # Collect the control qubits first so that each configuration is emitted as a single broadcast gate call.
+    # The indices are the set bits of the secret, extracted lowest first (s0 is the rightmost character).
+    controls = []
+    mask = int(secret_str, 2)
+    while mask:
+        controls.append((mask & -mask).bit_length() - 1)
+        mask &= mask - 1
+    if controls:
+        if use_ancilla:
+            circuit.cx(controls, [n] * len(controls))
+        elif use_paired_qubits:
+            circuit.cx(controls, [n + i for i in controls])
+        else:
+            # For the case without ancilla or paired qubits, we might need a different approach
+            # This is a placeholder and might need adjustment based on specific requirements
+            circuit.x(controls)
 
     circuit.barrier()
 
     # Measurement basis change
-    circuit.h(range(n))
+    circuit.h(qubits)
 
     # Measurement
-    circuit.measure(range(n), range(n))
+    circuit.measure(qubits, qubits)
 
     return circuit
 
 
-secret_string = "10110101"  # Example secret string
-bv_circuit = bernstein_vazirani_circuit(secret_string)
-print(bv_circuit)
+def check_stabilizer_ops(circuit: QuantumCircuit):
+    """
+    Ensure that a circuit only contains operations that can be simulated with the stabilizer method.
+
+    Args:
+        circuit (QuantumCircuit): The circuit to check.
+
+    Raises:
+        ValueError: If the circuit contains an operation outside of STABILIZER_OPS.
+    """
+    unsupported = set(circuit.count_ops()) - STABILIZER_OPS
+    if unsupported:
+        raise ValueError(
+            f"Circuit contains operations unsupported by the stabilizer method: {sorted(unsupported)}"
+        )
+
+
+def bernstein_vazirani_batch(secrets: list[str]) -> "np.ndarray":
+    """
+    Simulate the Bernstein-Vazirani algorithm for many secret strings at once.
+
+    The state vectors of the input register for all secrets are stored in one contiguous C-order buffer
+    (structure of arrays), with the secret as the leading axis. Every gate of the circuit is then applied as a
+    single vectorized NumPy update that broadcasts along that axis, so the Python overhead is paid once per gate
+    instead of once per gate and secret. The ancilla stays in the |-> state and is not stored; its CX gates act
+    as phase kickback, i.e. a Z gate on the control qubit.
+
+    Args:
+        secrets (list[str]): The secret binary strings. All strings must have the same length n.
+
+    Returns:
+        np.ndarray: A complex64 array of shape (len(secrets), 2**n) holding the final state vector of the input
+                    register for each secret. The argmax of each row is the recovered secret.
+
+    Raises:
+        ValueError: If no secret strings are given, a secret string is not a non-empty string of 0s and 1s,
+                    or the secret strings do not all have the same length.
+
+    Example:
+        >>> states = bernstein_vazirani_batch(["101", "011"])
+        >>> np.argmax(np.abs(states) ** 2, axis=1)
+        array([5, 3])
+    """
+    import numpy as np
+
+    if not secrets:
+        raise ValueError("At least one secret string must be given.")
+    for secret in secrets:
+        _check_secret(secret)
+    n = len(secrets[0])
+    if any(len(secret) != n for secret in secrets):
+        raise ValueError("All secret strings must have the same length.")
+
+    secret_ints = np.array([int(secret, 2) for secret in secrets])
+    states = np.empty((len(secrets), 2**n), dtype=np.complex64)
+    inv_sqrt2 = np.float32(1.0 / np.sqrt(2.0))
+
+    def hadamard_layer():
+        for qubit in range(n):
+            view = states.reshape(len(secrets), -1, 2, 2**qubit)
+            low = view[:, :, 0, :].copy()
+            view[:, :, 0, :] += view[:, :, 1, :]
+            view[:, :, 0, :] *= inv_sqrt2
+            view[:, :, 1, :] -= low
+            view[:, :, 1, :] *= -inv_sqrt2
+
+    # Initialize qubits
+    states[:] = 0
+    states[:, 0] = 1
+    hadamard_layer()
+
+    # Oracle implementation: phase kickback onto every control qubit of each secret
+    for qubit in range(n):
+        view = states.reshape(len(secrets), -1, 2, 2**qubit)
+        view[(secret_ints >> qubit) & 1 == 1, :, 1, :] *= -1
+
+    # Measurement basis change
+    hadamard_layer()
+
+    return states
+
+
+if __name__ == "__main__":
+    # Run from the repository root with `python -m qiskit_tutorial.bernstein_bazarani`.
+    # The simulator and plotting dependencies are only imported when the example is run, so that the circuit
+    # builders above can be reused as a library without their import cost.
+    import matplotlib
+    import numpy as np
+    from qiskit_aer import AerSimulator
+
+    # Render to files only, without initializing a GUI toolkit
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+
+    secret_string = "10110101"  # Example secret string
+    bv_circuit = bernstein_vazirani_circuit(secret_string)
+    print(bv_circuit)
+
+    # Execute the circuit on a simulator
+    # The BV circuit only consists of Clifford operations, so the stabilizer method simulates it in polynomial time
+    # and memory instead of storing all 2^(n+1) amplitudes of a state vector.
+    check_stabilizer_ops(bv_circuit)
+    simulator = AerSimulator(method="stabilizer")
+
+    # Execute the circuit
+    # check_stabilizer_ops has verified that every operation is native to the stabilizer simulator, so the circuit is
+    # submitted as is: no transpile() or pass manager is run before simulator.run().
+    job = simulator.run(bv_circuit, shots=1024)
+    result = job.result()
+
+    # state = Statevector(bv_circuit)
+    # print("Final state:")
+    # print(state)
+    # probabilities = state.probabilities()
+    # print("\nMeasurement probabilities:")
+    # for i, prob in enumerate(probabilities):
+    #     print(f"|{i:02b}>: {prob:.4f}")
 
-# Execute the circuit on a simulator
-# Create the AerSimulator
-simulator = AerSimulator()
+    # Get and print the results, sorted once by outcome for printing and plotting
+    counts = dict(sorted(result.get_counts().items()))
+    print("Measurement outcomes:", counts)
 
-# Execute the circuit
-job = simulator.run(bv_circuit, shots=1024)
-result = job.result()
+    # Cross-check against the specialized Numba simulator
+    from qiskit_tutorial._bv_numba import bv_statevector_numba
 
-# state = Statevector(bv_circuit)
-# print("Final state:")
-# print(state)
-# probabilities = state.probabilities()
-# print("\nMeasurement probabilities:")
-# for i, prob in enumerate(probabilities):
-#     print(f"|{i:02b}>: {prob:.4f}")
+    recovered = bv_statevector_numba(int(secret_string, 2), len(secret_string))
+    print("Numba simulated secret:", format(recovered, f"0{len(secret_string)}b"))
 
-# Get and print the results
-counts = result.get_counts()
-print("Measurement outcomes:", counts)
+    # Sweep over several secret strings in one batched simulation
+    sweep_secrets = [secret_string, "00000001", "11111111", "01010101"]
+    sweep_states = bernstein_vazirani_batch(sweep_secrets)
+    for secret, outcome in zip(
+        sweep_secrets, np.argmax(np.abs(sweep_states) ** 2, axis=1)
+    ):
+        print(f"Secret {secret} -> {outcome:0{len(secret)}b}")
 
-# Visualize the results
-plot_histogram(counts, filename="hist.png")
+    # Visualize the results
+    plt.close("all")
+    plt.bar(list(counts), list(counts.values()))
+    plt.xticks(rotation=70)
+    plt.xlabel("Measurement outcome")
+    plt.ylabel("Count")
+    plt.tight_layout()
+    plt.savefig("hist.png")
@@ -1,3 +1,4 @@
+import numpy as np
 from qiskit import QuantumCircuit
 from qiskit.quantum_info import Statevector
 
@@ -17,8 +18,14 @@ state = Statevector(qc)
 print("Final state:")
 print(state)
 
-# Calculate measurement probabilities
-probabilities = state.probabilities()
+# Calculate measurement probabilities directly from the amplitudes and format them in one go
+probabilities = np.abs(state.data) ** 2
+num_qubits = qc.num_qubits
+# Basis state labels: the bits of every index as one-character strings, viewed as one string per row
+bits = (np.arange(probabilities.size)[:, None] >> np.arange(num_qubits)[::-1]) & 1
+labels = bits.astype("U1").view(f"U{num_qubits}").ravel()
+lines = np.char.add(
+    np.char.add("|", labels), np.char.add(">: ", np.char.mod("%.4f", probabilities))
+)
 print("\nMeasurement probabilities:")
-for i, prob in enumerate(probabilities):
-    print(f"|{i:02b}>: {prob:.4f}")
+print("\n".join(lines))